@@ -1,7 +1,8 @@
+import asyncio
+import random
 import socket
 import struct
 import time
-import multiprocessing
 from collections import defaultdict
 
 # Configuration
@@ -10,140 +11,177 @@ SERVER_IP = '127.0.0.1'
 SERVER_PORT = 8080
 KEY = "a8eecf33-c18c-4d78-bf22-3770406e7768".encode('utf-8')
 COMMAND = "PULL".encode('utf-8')
+PREFETCH_DEPTH = 2  # Batches buffered ahead of the consumer
+STREAM_LIMIT = 4 * 1024 * 1024  # Bytes buffered per connection before reading pauses
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # Kernel receive buffer for large batches
+RECONNECT_MIN_DELAY = 1  # Seconds before the first reconnect attempt
+RECONNECT_MAX_DELAY = 30  # Cap for the exponential reconnect backoff
+
+# Precompiled big-endian length and offset fields
+UINT32 = struct.Struct(">I")
+UINT64 = struct.Struct(">Q")
+
+# Request frames keyed by broker name, see pull_template
+pull_templates = {}
 
 # Global variable for tracking total bytes received
-total_bytes_received = multiprocessing.Value('i', 0)
-
-def recv_all(sock, length):
-    """Ensure all data is received from the socket."""
-    data = b''
-    while len(data) < length:
-        packet = sock.recv(length - len(data))
-        if not packet:
-            raise ConnectionError("Connection closed prematurely")
-        data += packet
-    return data
-
-def fetch_messages(broker_name, offset, stats_queue, total_bytes_received):
+total_bytes_received = 0
+
+def pull_template(broker_name):
+    """Return the cached PULL frame for a broker; only its trailing offset varies."""
+    template = pull_templates.get(broker_name)
+    if template is None:
+        broker_name_bytes = broker_name.encode('utf-8')
+        message = struct.pack(
+            ">H{}sH{}sH{}sQ".format(len(KEY), len(COMMAND), len(broker_name_bytes)),
+            len(KEY),
+            KEY,
+            len(COMMAND),
+            COMMAND,
+            len(broker_name_bytes),
+            broker_name_bytes,
+            0
+        )
+        template = UINT32.pack(len(message)) + message
+        pull_templates[broker_name] = template
+    return template
+
+async def open_connection():
+    """Connect to the broker with socket options applied before the handshake."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # The receive window scale is negotiated on connect, so size it first
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+        s.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(s, (SERVER_IP, SERVER_PORT))
+        return await asyncio.open_connection(sock=s, limit=STREAM_LIMIT)
+    except Exception:
+        s.close()
+        raise
+
+async def pull_batches(reader, writer, broker_name, offset, batches):
+    """Keep PULL requests in flight and hand each received batch to the consumer."""
+    request = bytearray(pull_template(broker_name))
+    offset_slot = len(request) - 8
+    sock = writer.get_extra_info('socket')
+    try:
+        while True:
+            UINT64.pack_into(request, offset_slot, offset)
+            writer.write(bytes(request))
+            await writer.drain()
+
+            received_len = 0
+            received_count = 0
+            new_offset_bytes = None
+            while True:
+                # Read response length
+                response_length_bytes = await reader.readexactly(4)
+                response_length = UINT32.unpack(response_length_bytes)[0]
+
+                if response_length == 0:
+                    if new_offset_bytes != None:
+                       offset = offset + 1
+
+                    break  # No more messages in this batch
+
+                # Read new offset
+                new_offset_bytes = await reader.readexactly(8)
+                offset = UINT64.unpack(new_offset_bytes)[0]
+
+                if received_len > 1024*1024*100:
+                    print(f"Error: message {offset} length error!! length:{received_len}")
+                    break
+                # Read message data
+                total_data  = await reader.readexactly(response_length)
+                received_len += len(total_data)
+                received_count += 1
+
+            # PULL favours latency: TCP_NODELAY sends the request at once and
+            # TCP_QUICKACK acks the reply without the delayed-ACK wait. Linux
+            # clears QUICKACK again after use, so it is re-armed every batch.
+            if hasattr(socket, "TCP_QUICKACK"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+
+            # Only the batch totals are queued; each record is dropped once it
+            # has been measured, so queued batches hold no payload memory
+            await batches.put((offset, received_count, received_len))
+    except Exception:
+        await batches.put(None)
+
+async def fetch_messages(broker_name, offset, stats):
     """Fetch messages from the broker."""
+    global total_bytes_received
     message_count = 0
     data_volume = 0
     
     start_time = time.time()
+    backoff = RECONNECT_MIN_DELAY
     while True:
         try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.connect((SERVER_IP, SERVER_PORT))
-
+            # The loop reads large chunks into the stream buffer, so the 4-byte
+            # length and 8-byte offset reads are served without extra syscalls.
+            reader, writer = await open_connection()
+
+            # A reader task issues the next PULL as soon as a batch is
+            # queued, so the round trip overlaps with handling the batch.
+            batches = asyncio.Queue(maxsize=PREFETCH_DEPTH)
+            puller = asyncio.create_task(pull_batches(reader, writer, broker_name, offset, batches))
+            try:
                 while True:
-                    # Prepare the request message
-                    broker_name_bytes = broker_name.encode('utf-8')
-                    message = struct.pack(
-                        ">H{}sH{}sH{}sQ".format(len(KEY), len(COMMAND), len(broker_name_bytes)),
-                        len(KEY),
-                        KEY,
-                        len(COMMAND),
-                        COMMAND,
-                        len(broker_name_bytes),
-                        broker_name_bytes,
-                        offset
-                    )
-                    s.sendall(struct.pack(">I", len(message)) + message)
-                    
-                    received_len = 0
-                    new_offset_bytes = None
-                    while True:
-                        # Read response length
-                        response_length_bytes = recv_all(s, 4)
-                        response_length = struct.unpack(">I", response_length_bytes)[0]
-                        
-                        if response_length == 0:
-                            if new_offset_bytes != None:
-                               offset = offset + 1
-                            
-                            break  # No more messages in this batch
-                        
-                        
-                            
-                        # Read new offset
-                        new_offset_bytes = recv_all(s, 8)
-                        offset = struct.unpack(">Q", new_offset_bytes)[0]
-                        
-                        if received_len > 1024*1024*100:
-                            print(f"Error: message {offset} length error!! length:{received_len}")
-                            break
-                        # Read message data
-                        total_data  = recv_all(s, response_length)
-                        received_len += len(total_data)
-                        message_count += 1
-                        
-                    
+                    batch = await batches.get()
+                    if batch is None:
+                        raise ConnectionError("Reader task stopped")
+                    offset, received_count, received_len = batch
+                    backoff = RECONNECT_MIN_DELAY
+
+                    message_count += received_count
                     data_volume += received_len
                     
                     # Update global bytes received
-                    with total_bytes_received.get_lock():
-                        total_bytes_received.value += received_len
+                    total_bytes_received += received_len
 
                     current_time = time.time()
                     if current_time - start_time >= 60:  # Report stats every minute
-                        stats_queue.put((broker_name, message_count, data_volume / (1024 * 1024)))  # Data volume in MB
+                        report_stats(stats, broker_name, message_count, data_volume / (1024 * 1024))  # Data volume in MB
                         message_count = 0
                         data_volume = 0
                         start_time = current_time
+            finally:
+                puller.cancel()
+                writer.close()
 
         except Exception as e:
             #print(f"Error fetching messages from broker {broker_name}: {e}")
-            time.sleep(1)
-
-def stats_collector(stats_queue, num_processes):
-    """Collect and print statistics from all processes."""
-    stats = defaultdict(lambda: {"message_count": 0, "data_volume": 0})
-    finished_processes = 0
+            # Back off exponentially with jitter so a flapping broker is not
+            # hit by every consumer reconnecting in lockstep
+            await asyncio.sleep(backoff + random.random())
+            backoff = min(RECONNECT_MAX_DELAY, backoff * 2)
 
-    while finished_processes < num_processes:
-        item = stats_queue.get()
-        if item == "DONE":
-            finished_processes += 1
-            continue
+def report_stats(stats, broker_name, message_count, data_volume):
+    """Accumulate and print statistics from all brokers."""
+    stats[broker_name]["message_count"] += message_count
+    stats[broker_name]["data_volume"] += data_volume
 
-        broker_name, message_count, data_volume = item
-        stats[broker_name]["message_count"] += message_count
-        stats[broker_name]["data_volume"] += data_volume
-
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Broker Stats:")
-        for broker, data in stats.items():
-            print(f"  {broker}: {data['message_count']} messages/s, {data['data_volume']:.2f} MB/s")
-
-    print("\nFinal Averages:")
+    print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Broker Stats:")
     for broker, data in stats.items():
-        print(f"  {broker}: {data['message_count'] / num_processes:.2f} messages/s, {data['data_volume'] / num_processes:.2f} MB/s")
-
-if __name__ == "__main__":
-    stats_queue = multiprocessing.Queue()
-    num_processes = len(BROKER_NAMES)
+        print(f"  {broker}: {data['message_count']} messages/s, {data['data_volume']:.2f} MB/s")
 
-    processes = []
-    for broker_name in BROKER_NAMES:
-        offset = 0
-        p = multiprocessing.Process(target=fetch_messages, args=(broker_name, offset, stats_queue, total_bytes_received))
-        processes.append(p)
+async def main(stats):
+    # One event loop multiplexes the connections to every broker
+    await asyncio.gather(*(fetch_messages(broker_name, 0, stats) for broker_name in BROKER_NAMES))
 
-    stats_process = multiprocessing.Process(target=stats_collector, args=(stats_queue, num_processes))
-    stats_process.start()
-
-    for p in processes:
-        p.start()
+if __name__ == "__main__":
+    stats = defaultdict(lambda: {"message_count": 0, "data_volume": 0})
+    num_brokers = len(BROKER_NAMES)
 
     try:
-        for p in processes:
-            p.join()
+        asyncio.run(main(stats))
     except KeyboardInterrupt:
-        print("Stopping processes...")
-    finally:
-        for p in processes:
-            p.terminate()
-            stats_queue.put("DONE")
+        print("Stopping consumers...")
 
-    stats_process.join()
+    print("\nFinal Averages:")
+    for broker, data in stats.items():
+        print(f"  {broker}: {data['message_count'] / num_brokers:.2f} messages/s, {data['data_volume'] / num_brokers:.2f} MB/s")
 
-    print(f"Final total bytes received: {total_bytes_received.value / (1024 * 1024):.2f} MB")
+    print(f"Final total bytes received: {total_bytes_received / (1024 * 1024):.2f} MB")
@@ -1,8 +1,8 @@
+import asyncio
+import os
 import socket
 import struct
 import random
-import string
-import multiprocessing
 import time
 from collections import defaultdict
 
@@ -12,109 +12,191 @@ KEY = "a8eecf33-c18c-4d78-bf22-3770406e7768".encode('utf-8')
 COMMAND = "PUSH".encode('utf-8')
 SERVER_IP = '127.0.0.1'
 SERVER_PORT = 8080
-
-def generate_random_string(size):
-    chars = string.ascii_letters + string.digits + string.punctuation
-    return ''.join(random.choice(chars) for _ in range(size)).encode('utf-8')
-
-def send_push_message(broker_name, payload):
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+REPORT_INTERVAL = 60  # Seconds between stats reports
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024  # Kernel send buffer for payloads up to 1 MB
+PAYLOAD_MIN_SIZE = 512
+PAYLOAD_SIZE_SPAN = 1024 * 1024 - PAYLOAD_MIN_SIZE + 1
+BATCH_SIZE = 16  # PUSH requests written before waiting for their replies
+RECONNECT_MIN_DELAY = 1  # Seconds before the first reconnect attempt
+RECONNECT_MAX_DELAY = 30  # Cap for the exponential reconnect backoff
+
+# Precompiled big-endian length field
+UINT32 = struct.Struct(">I")
+
+# Request headers keyed by broker name, see push_header
+push_headers = {}
+
+def generate_random_payload(size):
+    return os.urandom(size)
+
+def push_header(broker_name):
+    """Return the cached PUSH header for a broker; the payload follows it on the wire."""
+    header = push_headers.get(broker_name)
+    if header is None:
+        broker_name_bytes = broker_name.encode('utf-8')
+        header = struct.pack(
+            ">H{}sH{}sH{}s".format(len(KEY), len(COMMAND), len(broker_name_bytes)),
+            len(KEY),
+            KEY,
+            len(COMMAND),
+            COMMAND,
+            len(broker_name_bytes),
+            broker_name_bytes
+        )
+        push_headers[broker_name] = header
+    return header
+
+async def open_connection():
+    """Open the persistent connection a broker's messages are pushed over."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        s.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(s, (SERVER_IP, SERVER_PORT))
+    except Exception:
+        s.close()
+        raise
+    return s
+
+async def recv_all(sock, length):
+    """Ensure all data is received from the socket."""
+    loop = asyncio.get_running_loop()
+    data = bytearray(length)
+    view = memoryview(data)
+    received = 0
+    while received < length:
+        n = await loop.sock_recv_into(sock, view[received:])
+        if not n:
+            raise ConnectionError("Connection closed prematurely")
+        received += n
+    return data
+
+async def wait_writable(sock):
+    """Wait until the non-blocking socket can accept more data."""
+    loop = asyncio.get_running_loop()
+    writable = loop.create_future()
+    loop.add_writer(sock.fileno(), lambda: writable.done() or writable.set_result(None))
+    try:
+        await writable
+    finally:
+        loop.remove_writer(sock.fileno())
+
+async def sendmsg_all(sock, buffers):
+    """Gather-write all buffers to the socket without joining them first."""
+    views = [memoryview(b) for b in buffers]
+    while views:
         try:
-            s.connect((SERVER_IP, SERVER_PORT))
-            broker_name_bytes = broker_name.encode('utf-8')
-            
-            message = struct.pack(
-                ">H{}sH{}sH{}s".format(len(KEY), len(COMMAND), len(broker_name_bytes)),
-                len(KEY),
-                KEY,
-                len(COMMAND),
-                COMMAND,
-                len(broker_name_bytes),
-                broker_name_bytes
-            )
-            message += payload
-
-            message_length = len(message)
-            s.sendall(struct.pack(">I", message_length) + message)
-
-            response_length = struct.unpack(">I", s.recv(4))[0]
-            s.recv(response_length)  # Read response (not used in this test)
-        except Exception as e:
-            print(f"Error sending message to broker {broker_name}: {e}")
-
-def worker_process(broker_name, process_id, stats_queue):
-    message_count = 0
-    data_volume = 0
-
-    start_time = time.time()
-
+            sent = sock.sendmsg(views)
+        except BlockingIOError:
+            await wait_writable(sock)
+            continue
+        while views and sent >= views[0].nbytes:
+            sent -= views[0].nbytes
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+
+async def send_push_messages(sock, broker_name, payloads):
+    """Write a batch of PUSH requests at once, then yield as each reply arrives in order."""
+    header = push_header(broker_name)
+
+    # The whole batch goes out through gathered sendmsg calls straight from
+    # each buffer; payloads are never joined to the header or to each other
+    buffers = []
+    for payload in payloads:
+        buffers += [UINT32.pack(len(header) + len(payload)), header, payload]
+
+    # Bulk PUSH favours throughput: cork the socket while the batch is written
+    # so it leaves as full-sized segments. sendmsg_all only returns once the
+    # kernel holds every byte, so uncorking afterwards flushes just the tail.
+    if hasattr(socket, "TCP_CORK"):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1)
+    try:
+        await sendmsg_all(sock, buffers)
+    finally:
+        if hasattr(socket, "TCP_CORK"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 0)
+
+    for _ in payloads:
+        response_length = UINT32.unpack(await recv_all(sock, 4))[0]
+        await recv_all(sock, response_length)  # Read response (not used in this test)
+        yield
+
+async def push_messages(broker_name, stats):
+    sock = None
+    backoff = RECONNECT_MIN_DELAY
+    try:
+        while True:
+            payloads = [
+                generate_random_payload(PAYLOAD_MIN_SIZE + int(random.random() * PAYLOAD_SIZE_SPAN))  # Random payload size between 512 bytes and 1 MB
+                for _ in range(BATCH_SIZE)
+            ]
+            while payloads:
+                acked = 0
+                try:
+                    if sock is None:
+                        sock = await open_connection()
+                    async for _ in send_push_messages(sock, broker_name, payloads):
+                        stats[broker_name]["message_count"] += 1
+                        stats[broker_name]["data_volume"] += len(payloads[acked])
+                        acked += 1
+                    backoff = RECONNECT_MIN_DELAY
+                except OSError as e:
+                    # Reconnect and retry only the messages the broker has not acknowledged
+                    print(f"Error sending message to broker {broker_name}: {e}")
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                    # Back off exponentially with jitter while the broker is unavailable
+                    await asyncio.sleep(backoff + random.random())
+                    backoff = min(RECONNECT_MAX_DELAY, backoff * 2)
+                payloads = payloads[acked:]
+    finally:
+        if sock is not None:
+            sock.close()
+
+def print_rates(rates):
+    for broker, data in rates.items():
+        print(f"  {broker}: {data['message_count']:.2f} messages/s, {data['data_volume']:.2f} MB/s")
+
+def rates_since(stats, previous, elapsed):
+    """Turn the difference between two stats snapshots into per-second rates."""
+    rates = {}
+    for broker, data in stats.items():
+        previous_data = previous.get(broker, {"message_count": 0, "data_volume": 0})
+        rates[broker] = {
+            "message_count": (data["message_count"] - previous_data["message_count"]) / elapsed,
+            "data_volume": (data["data_volume"] - previous_data["data_volume"]) / elapsed / (1024 * 1024),  # Data volume in MB
+        }
+    return rates
+
+async def stats_collector(stats):
+    previous = {}
+    last_report = time.time()
     while True:
-        payload_size = random.randint(512, 1024 * 1024)  # Random payload size between 512 bytes and 1 MB
-        payload = generate_random_string(payload_size)
-        send_push_message(broker_name, payload)
-
-        message_count += 1
-        data_volume += payload_size
-
+        await asyncio.sleep(REPORT_INTERVAL)
         current_time = time.time()
-        if current_time - start_time >= 60:  # Report stats every minute
-            stats_queue.put((process_id, broker_name, message_count, data_volume / (1024 * 1024)))  # Data volume in MB
-            message_count = 0
-            data_volume = 0
-            start_time = current_time
-
-def stats_collector(stats_queue, num_processes):
-    stats = defaultdict(lambda: defaultdict(lambda: {"message_count": 0, "data_volume": 0}))
-    overall_stats = defaultdict(lambda: {"message_count": 0, "data_volume": 0})
-    finished_processes = set()
-
-    while len(finished_processes) < num_processes:
-        item = stats_queue.get()
-        if item == "DONE":
-            finished_processes.add(stats_queue.get())
-            continue
-
-        process_id, broker_name, message_count, data_volume = item
-        stats[broker_name][process_id]["message_count"] = message_count
-        stats[broker_name][process_id]["data_volume"] = data_volume
+        rates = rates_since(stats, previous, current_time - last_report)
+        previous = {broker: dict(data) for broker, data in stats.items()}
+        last_report = current_time
 
-        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Broker Stats (Process {process_id}):")
-        for broker, processes in stats.items():
-            for pid, data in processes.items():
-                print(f"  {broker} (Process {pid}): {data['message_count']} messages/s, {data['data_volume']:.2f} MB/s")
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Broker Stats:")
+        print_rates(rates)
 
-    # Calculate and print averages
-    print("\nFinal Averages:")
-    for broker, processes in stats.items():
-        total_messages = 0
-        total_data = 0
-        for data in processes.values():
-            total_messages += data["message_count"]
-            total_data += data["data_volume"]
-        overall_stats[broker]["message_count"] = total_messages / len(processes)
-        overall_stats[broker]["data_volume"] = total_data / len(processes)
-        print(f"  {broker}: {overall_stats[broker]['message_count']:.2f} messages/s, {overall_stats[broker]['data_volume']:.2f} MB/s")
+async def main(stats):
+    # One event loop drives a persistent connection to every broker
+    await asyncio.gather(stats_collector(stats), *(push_messages(broker_name, stats) for broker_name in BROKER_NAMES))
 
 if __name__ == "__main__":
-    stats_queue = multiprocessing.Queue()
-    num_processes = len(BROKER_NAMES) * 2
-
-    processes = []
-    for i, broker_name in enumerate(BROKER_NAMES):
-        for j in range(2):  # 2 processes per broker
-            process_id = i * 2 + j
-            p = multiprocessing.Process(target=worker_process, args=(broker_name, process_id, stats_queue))
-            processes.append(p)
-
-    stats_process = multiprocessing.Process(target=stats_collector, args=(stats_queue, num_processes))
-    stats_process.start()
-
-    for p in processes:
-        p.start()
+    stats = defaultdict(lambda: {"message_count": 0, "data_volume": 0})
+    start_time = time.time()
 
-    for p in processes:
-        p.join()
-        stats_queue.put("DONE")
-        stats_queue.put(processes.index(p))
+    try:
+        asyncio.run(main(stats))
+    except KeyboardInterrupt:
+        print("Stopping producers...")
 
-    stats_process.join()
+    print("\nFinal Averages:")
+    print_rates(rates_since(stats, {}, time.time() - start_time))
@@ -3,6 +3,12 @@ import struct
 
 PUSH_COMMAND = b'PUSH'
 PULL_COMMAND = b'PULL'
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+READ_BUFFER_SIZE = 64 * 1024
+
+# Precompiled big-endian length and offset fields
+UINT32 = struct.Struct(">I")
+UINT64 = struct.Struct(">Q")
 
 class Client:
     def __init__(self, server_ip, server_port, key):
@@ -10,13 +16,24 @@ class Client:
         self.server_port = server_port
         self.key = key.encode("utf-8")
         self.connection = None  # Maintain a persistent connection
+        self.reader = None  # Buffered reader over the connection
+        self.push_headers = {}  # PUSH headers keyed by broker name
+        self.pull_prefixes = {}  # PULL frames without the offset, keyed by broker name
 
     def connect(self):
         """Establish a persistent connection if not already connected."""
         if self.connection is None:
             try:
                 self.connection = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                # Buffer sizes must be set before connect to affect window scaling
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
                 self.connection.connect((self.server_ip, self.server_port))
+                # Reply framing is read through the C BufferedReader, so the small
+                # length and offset fields come out of its buffer, not a syscall
+                self.reader = self.connection.makefile('rb', buffering=READ_BUFFER_SIZE)
             except Exception as e:
                 self.connection = None
                 raise ConnectionError(f"Failed to connect to server: {e}")
@@ -25,20 +42,22 @@ class Client:
         """Close the persistent connection."""
         if self.connection:
             try:
+                # The socket is only released once its reader is closed too
+                if self.reader:
+                    self.reader.close()
                 self.connection.close()
             except Exception as e:
                 print(f"Error closing connection: {e}")
             finally:
+                self.reader = None
                 self.connection = None
 
-    def send_push_message(self, broker_name, payload):
-        """Send a message to the broker."""
-        try:
-            self.connect()
+    def push_header(self, broker_name):
+        """Return the cached PUSH header for a broker."""
+        header = self.push_headers.get(broker_name)
+        if header is None:
             broker_name_bytes = broker_name.encode('utf-8')
-
-            # Construct message
-            message = struct.pack(
+            header = struct.pack(
                 ">H{}sH{}sH{}s".format(len(self.key), len(PUSH_COMMAND), len(broker_name_bytes)),
                 len(self.key),
                 self.key,
@@ -47,14 +66,41 @@ class Client:
                 len(broker_name_bytes),
                 broker_name_bytes
             )
-            message += payload
+            self.push_headers[broker_name] = header
+        return header
 
-            # Send message length and message
-            message_length = len(message)
-            self.connection.sendall(struct.pack(">I", message_length) + message)
+    def pull_prefix(self, broker_name):
+        """Return the cached PULL frame for a broker, up to its trailing 8-byte offset."""
+        prefix = self.pull_prefixes.get(broker_name)
+        if prefix is None:
+            broker_name_bytes = broker_name.encode('utf-8')
+            prefix = struct.pack(
+                ">IH{}sH{}sH{}s".format(len(self.key), len(PULL_COMMAND), len(broker_name_bytes)),
+                2 + len(self.key) + 2 + len(PULL_COMMAND) + 2 + len(broker_name_bytes) + 8,
+                len(self.key),
+                self.key,
+                len(PULL_COMMAND),
+                PULL_COMMAND,
+                len(broker_name_bytes),
+                broker_name_bytes
+            )
+            self.pull_prefixes[broker_name] = prefix
+        return prefix
+
+    def send_push_message(self, broker_name, payload):
+        """Send a message to the broker."""
+        try:
+            self.connect()
+
+            # The header is cached per broker; the payload is sent after it without copying
+            header = self.push_header(broker_name)
+
+            # Send message length, header and payload
+            message_length = len(header) + len(payload)
+            self.sendmsg_all([UINT32.pack(message_length), header, payload])
 
             # Receive response length
-            response_length = struct.unpack(">I", self.recv_all(4))[0]
+            response_length = UINT32.unpack(self.recv_all(4))[0]
             response = self.recv_all(response_length)  # Read response (if needed)
             return response
 
@@ -67,29 +113,18 @@ class Client:
             self.connect()
 
             # Prepare the request message
-            broker_name_bytes = broker_name.encode('utf-8')
-            message = struct.pack(
-                ">H{}sH{}sH{}sQ".format(len(self.key), len(PULL_COMMAND), len(broker_name_bytes)),
-                len(self.key),
-                self.key,
-                len(PULL_COMMAND),
-                PULL_COMMAND,
-                len(broker_name_bytes),
-                broker_name_bytes,
-                offset
-            )
-            self.connection.sendall(struct.pack(">I", len(message)) + message)
+            self.sendmsg_all([self.pull_prefix(broker_name), UINT64.pack(offset)])
 
             # Read response length
             response_length_bytes = self.recv_all(4)
-            response_length = struct.unpack(">I", response_length_bytes)[0]
+            response_length = UINT32.unpack(response_length_bytes)[0]
 
             if response_length == 0:
                 return None  # No more messages
 
             # Read new offset
             new_offset_bytes = self.recv_all(8)
-            new_offset = struct.unpack(">Q", new_offset_bytes)[0]
+            new_offset = UINT64.unpack(new_offset_bytes)[0]
 
             # Read message data
             message_data = self.recv_all(response_length)
@@ -99,14 +134,22 @@ class Client:
         except Exception as e:
             print(f"Error fetching messages from broker {broker_name}: {e}")
 
+    def sendmsg_all(self, buffers):
+        """Gather-write all buffers to the connection without joining them first."""
+        views = [memoryview(b) for b in buffers]
+        while views:
+            sent = self.connection.sendmsg(views)
+            while views and sent >= views[0].nbytes:
+                sent -= views[0].nbytes
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
+
     def recv_all(self, length):
         """Helper function to receive the exact amount of data."""
-        data = b''
-        while len(data) < length:
-            packet = self.connection.recv(length - len(data))
-            if not packet:
-                raise ConnectionError("Socket connection broken")
-            data += packet
+        data = self.reader.read(length)
+        if len(data) < length:
+            raise ConnectionError("Socket connection broken")
         return data
 
 # Example usage
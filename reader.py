@@ -1,30 +1,117 @@
+import mmap
+import os
 import struct
 
 # 定义每条记录头部的大小和结构
 HEADER_SIZE = 12
 HEADER_FORMAT = '>IQ'  # > 表示大端模式, I 表示 4 字节无符号整数, Q 表示 8 字节无符号整数
+HEADER = struct.Struct(HEADER_FORMAT)
+# 位置表文件的后缀, 与 .data 文件放在同一目录, .data 删除后随之清理
+TABLE_SUFFIX = '.positions'
+# 位置表文件格式: 魔数, 扫描结束偏移量, 条目数, 之后是 (位置编号, 文件偏移量) 条目
+# 只用 struct 读写纯数据, 不使用 pickle, 被篡改的文件也无法执行代码
+TABLE_MAGIC = b'SRPT'
+TABLE_HEADER = struct.Struct('>4sQQ')
+TABLE_ENTRY = struct.Struct('>QQ')
+
+def scan_positions(mv, table, off):
+    # 从 off 开始在用户态遍历头部, 记录 位置编号 -> 记录在文件中的偏移量
+    # 只收录完整的记录, 返回扫描停止处的偏移量, 以便文件增长后从这里继续
+    while off + HEADER_SIZE <= len(mv):
+        data_len, position = HEADER.unpack_from(mv, off)
+        if off + HEADER_SIZE + data_len > len(mv):
+            break
+        table[position] = off
+        off += HEADER_SIZE + data_len
+    return off
+
+def remove_stale_tables(directory):
+    # 清理器只删除 .index/.data 文件, 这里删除对应 .data 已被删除的位置表
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == TABLE_SUFFIX and not os.path.exists(os.path.join(directory, stem + '.data')):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+def read_position_table(table_path):
+    # 读取保存的位置表, 文件缺失或格式不符时返回空表
+    try:
+        with open(table_path, 'rb') as f:
+            data = f.read()
+        magic, end, count = TABLE_HEADER.unpack_from(data)
+    except (OSError, struct.error):
+        return 0, {}
+    if magic != TABLE_MAGIC or len(data) != TABLE_HEADER.size + count * TABLE_ENTRY.size:
+        return 0, {}
+    return end, dict(TABLE_ENTRY.iter_unpack(memoryview(data)[TABLE_HEADER.size:]))
+
+def write_position_table(table_path, end, table):
+    data = bytearray(TABLE_HEADER.size + len(table) * TABLE_ENTRY.size)
+    TABLE_HEADER.pack_into(data, 0, TABLE_MAGIC, end, len(table))
+    off = TABLE_HEADER.size
+    for position, record_off in table.items():
+        TABLE_ENTRY.pack_into(data, off, position, record_off)
+        off += TABLE_ENTRY.size
+    with open(table_path, 'wb') as f:
+        f.write(data)
+
+def load_position_table(file_path, mv, rescan=False):
+    # 复用保存的位置表; 文件增长时只扫描新追加的部分, 文件变短或要求重扫时从头扫描
+    directory = os.path.dirname(file_path) or '.'
+    remove_stale_tables(directory)
+
+    table_path = os.path.splitext(file_path)[0] + TABLE_SUFFIX
+    end, table = (0, {}) if rescan else read_position_table(table_path)
+    if end > len(mv):
+        end, table = 0, {}
+
+    new_end = scan_positions(mv, table, end)
+    if rescan or new_end != end or not os.path.exists(table_path):
+        try:
+            write_position_table(table_path, new_end, table)
+        except OSError:
+            pass
+    return table
+
+def find_record(mv, table, target_position):
+    # 返回目标记录的偏移量, 位置表中的偏移量与文件内容不符时返回 None
+    off = table.get(target_position)
+    if off is None or off + HEADER_SIZE > len(mv):
+        return None
+    data_len, position = HEADER.unpack_from(mv, off)
+    if position != target_position or off + HEADER_SIZE + data_len > len(mv):
+        return None
+    return off
 
 def read_record_by_position(file_path, target_position):
     with open(file_path, 'rb') as f:
-        while True:
-            # 读取头部数据
-            header = f.read(HEADER_SIZE)
-            if not header:
-                print("Position not found in the file.")
-                break
-
-            # 解析头部数据
-            data_len, position = struct.unpack(HEADER_FORMAT, header)
-
-            # 检查是否是目标位置
-            if position == target_position:
-                data = f.read(data_len)
+        if os.fstat(f.fileno()).st_size == 0:
+            print("Position not found in the file.")
+            return None
+
+        with mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ) as mm:
+            mv = memoryview(mm)
+            try:
+                table = load_position_table(file_path, mv)
+
+                # 查找目标位置对应的记录, 位置表不可信时重新扫描一次
+                off = find_record(mv, table, target_position)
+                if off is None and target_position in table:
+                    table = load_position_table(file_path, mv, rescan=True)
+                    off = find_record(mv, table, target_position)
+                if off is None:
+                    print("Position not found in the file.")
+                    return None
+
+                data_len, _ = HEADER.unpack_from(mv, off)
+                data = bytes(mv[off + HEADER_SIZE:off + HEADER_SIZE + data_len])
                 print(f"Data length: {data_len}")
                 print(f"Actully Data length: {len(data)}")
-                return
-
-            # 跳过当前记录的数据部分
-            f.seek(data_len, 1)
+                return data
+            finally:
+                mv.release()
 
 # 示例调用
 file_path = "/disk/lyn/workspace/esw/messages/test_broker/000000000200.data"  # 替换为你的文件路径